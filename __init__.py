@@ -1,10 +1,16 @@
+import asyncio
 import datetime
 import re
 from abc import ABC, abstractmethod
+from collections import deque
 from logging import getLogger
+from pathlib import Path
+from typing import Callable, TypeVar
 
 import aiohttp
 import discord
+import orjson
+from cachetools import TTLCache
 from discord.ext import commands, tasks
 from yarl import URL
 
@@ -30,87 +36,174 @@ class VideoInfo:
         self,
         data: dict,
         audio_url: URL,
+        audio_format: dict,
         input_url: str,
         yt_url: str,
     ) -> None:
         self.data = data
         self.audio_url = audio_url
+        self.audio_format = audio_format
         self.input_url = input_url
         self.yt_url = yt_url
 
 
 class ChannelPlayer:
+    FFMPEG_BEFORE_OPTIONS = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 3"
+
     def __init__(self, connection: discord.VoiceClient) -> None:
         self.connection: discord.VoiceClient = connection
-        self.queue: list[VideoInfo] = []
+        self.queue: deque[VideoInfo] = deque()
         self.now_playing: VideoInfo | None = None
         self.loop: bool = False
+        self._volume: float = 1.0
+        # Set whenever the current source supports changing the volume on the fly
+        self._transformer: discord.PCMVolumeTransformer | None = None
 
     @property
     def volume(self) -> float:
-        if isinstance(self.connection.source, discord.PCMVolumeTransformer):
-            # One of us is wrong about this being defined, and I am betting on it being the type checker (it's me)
-            return self.connection.source.volume  # type: ignore[attr-defined]
-        else:
-            raise ValueError("Audio source is not a volume transformer")
+        return self._volume
 
     @volume.setter
     def volume(self, value: float) -> None:
-        if isinstance(self.connection.source, discord.PCMVolumeTransformer):
-            self.connection.source.volume = value
-        else:
-            raise ValueError("Audio source is not a volume transformer")
+        self._volume = value
+        if self._transformer is not None:
+            self._transformer.volume = value
+
+    @property
+    def volume_adjustable(self) -> bool:
+        # Whether volume changes apply to the current song, rather than only from the next one
+        return self._transformer is not None
+
+    def create_source(self, video_info: VideoInfo) -> discord.AudioSource:
+        if self._volume == 1.0:
+            self._transformer = None
+            # Let ffmpeg hand us opus directly, instead of discord.py scaling and encoding every frame in python.
+            # Opus streams can even be passed through untouched.
+            is_opus = 'codecs="opus"' in video_info.audio_format["type"]
+            return discord.FFmpegOpusAudio(
+                str(video_info.audio_url),
+                codec="copy" if is_opus else None,
+                before_options=self.FFMPEG_BEFORE_OPTIONS,
+            )
+        self._transformer = discord.PCMVolumeTransformer(
+            discord.FFmpegPCMAudio(str(video_info.audio_url), before_options=self.FFMPEG_BEFORE_OPTIONS),
+            volume=self._volume,
+        )
+        return self._transformer
 
 
 ChannelID = int
+T = TypeVar("T")
+
+
+class NotInVoiceChannel(commands.CheckFailure):
+    pass
+
+
+def in_voice_channel() -> Callable[[T], T]:
+    async def predicate(ctx: commands.Context) -> bool:
+        if not (isinstance(ctx.author, discord.Member) and ctx.author.voice and ctx.author.voice.channel):
+            raise NotInVoiceChannel("You must be in a voice channel to use this command")
+        return True
+
+    return commands.check(predicate)
+
+
+def voice_channel(ctx: commands.Context) -> discord.VoiceChannel | discord.StageChannel:
+    # Only to be used in commands guarded by in_voice_channel
+    return ctx.author.voice.channel  # type: ignore[union-attr, return-value]
 
 
 class PolyPlayer(breadcord.module.ModuleCog):
     def __init__(self, module_id: str) -> None:
         super().__init__(module_id)
-        self.invidious = Invidious(host_url=self.settings.invidious_host_url.value)  # type: ignore[call-arg]
-        self.translator = Translator(settings=self.settings, invidious=self.invidious)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, limit_per_host=8, keepalive_timeout=75, ttl_dns_cache=300),
+            headers={"User-Agent": "PolyPlayer/1.0"},
+        )
+        self.invidious = Invidious(
+            session=self.session,
+            host_url=self.settings.invidious_host_url.value,  # type: ignore[call-arg]
+            host_cache_path=self.module.storage_path / "invidious_host.json",
+        )
+        self.translator = Translator(session=self.session, settings=self.settings, invidious=self.invidious)
         self.players: dict[ChannelID, ChannelPlayer] = {}
+        # Guards connecting, disconnecting and (un)registering the player of a channel
+        self._voice_locks: dict[ChannelID, asyncio.Lock] = {}
 
     async def cog_load(self) -> None:
         await super().cog_load()
         await self.invidious.load()
         await self.translator.load()
 
-        self.play_queue.start()
-
     async def cog_unload(self) -> None:
         await super().cog_unload()
         await self.invidious.close()
         await self.translator.close()
+        await self.session.close()
 
-    @tasks.loop(seconds=1)
-    async def play_queue(self) -> None:
-        for guild_id, player in dict(self.players).items():
-            if player.connection.is_playing() or player.connection.is_paused():
-                continue
+    async def cog_command_error(self, ctx: commands.Context, error: Exception) -> None:
+        if isinstance(error, (NotInVoiceChannel, commands.NoPrivateMessage)):
+            await ctx.reply(str(error), ephemeral=True)
+            return
+        # Having a cog error handler stops the bot's default handler from logging anything, so do it ourselves
+        self.logger.error(f"Ignoring exception in command {ctx.command}", exc_info=error)
+
+    def _voice_lock(self, channel_id: ChannelID) -> asyncio.Lock:
+        return self._voice_locks.setdefault(channel_id, asyncio.Lock())
+
+    async def _advance(self, channel_id: ChannelID) -> None:
+        # This runs from the after callback, where nobody would see an exception, so log it instead
+        try:
+            await self._play_next(channel_id)
+        except Exception:
+            self.logger.exception(f"Failed to advance the queue in channel {channel_id}")
+
+    async def _play_next(self, channel_id: ChannelID) -> None:
+        async with self._voice_lock(channel_id):
+            player = self.players.get(channel_id)
+            if player is None:
+                return
+            connection = player.connection
+            if not connection.is_connected():
+                # We were disconnected from outside, e.g. kicked from the channel
+                self.players.pop(channel_id, None)
+                return
+            if connection.is_playing() or connection.is_paused():
+                return
             if not player.queue:
-                await player.connection.disconnect()
-                del self.players[guild_id]
-                continue
+                self.players.pop(channel_id, None)
+                await connection.disconnect()
+                return
 
-            video_info = player.queue.pop(0)
+            video_info = player.queue.popleft()
             if player.loop:
                 player.queue.append(video_info)
             player.now_playing = video_info
 
-            player.connection.play(discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(
-                str(video_info.audio_url),
-                before_options="-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 3",
-            )))
+            # The after callback is called from the audio player thread, so we have to hop back onto the event loop
+            loop = asyncio.get_running_loop()
+
+            def after(error: Exception | None) -> None:
+                if error is not None:
+                    self.logger.error(f"Player error in channel {channel_id}: {error}")
+                asyncio.run_coroutine_threadsafe(self._advance(channel_id), loop)
+
+            try:
+                connection.play(player.create_source(video_info), after=after)
+            except Exception:
+                # Without a running track no after callback will come, so don't leave a stuck player around
+                self.players.pop(channel_id, None)
+                if connection.is_connected():
+                    await connection.disconnect()
+                raise
 
     @commands.hybrid_command()
+    @commands.guild_only()
+    @in_voice_channel()
     async def play(self, ctx: commands.Context, url: str | None = None) -> None:
-        if not (ctx.guild and isinstance(ctx.author, discord.Member) and ctx.author.voice and ctx.author.voice.channel):
-            await ctx.reply("You must be in a voice channel to use this command", ephemeral=True)
-            return
-
-        player = self.players.get(ctx.author.voice.channel.id)
+        channel = voice_channel(ctx)
+        player = self.players.get(channel.id)
         if player and player.connection.is_paused() and not player.queue:
             player.connection.resume()
             if url is None:
@@ -125,28 +218,33 @@ class PolyPlayer(breadcord.module.ModuleCog):
                 await ctx.reply("Invalid URL", ephemeral=True)
                 return
             video = await self.invidious.get_video(video_id)
-            audio_url = await self.invidious.get_audio_url(video)
+            audio_format = self.invidious.get_audio_format(video)
+            audio_url = await self.invidious.get_audio_url(video, audio_format)
         except BadResponseError as error:
             await ctx.reply(f"Error: {error}")
             return
 
-        player = self.players.get(ctx.author.voice.channel.id)  # Race condition, this helps a bit
-        player = player or ChannelPlayer(await ctx.author.voice.channel.connect())
-        player.queue.append(VideoInfo(
+        video_info = VideoInfo(
             video,
             audio_url,
+            audio_format,
             input_url=url,
             yt_url=f"https://www.youtube.com/watch?v={video_id}",
-        ))
-        self.players[ctx.author.voice.channel.id] = player
-        await ctx.reply(f"Added [{video['title']}](<{player.queue[-1].yt_url}>) to the queue")
+        )
+        async with self._voice_lock(channel.id):
+            player = self.players.get(channel.id)
+            if player is None or not player.connection.is_connected():
+                player = ChannelPlayer(await channel.connect())
+            player.queue.append(video_info)
+            self.players[channel.id] = player
+        await ctx.reply(f"Added [{video['title']}](<{video_info.yt_url}>) to the queue")
+        await self._advance(channel.id)
 
     @commands.hybrid_command()
+    @commands.guild_only()
+    @in_voice_channel()
     async def queue(self, ctx: commands.Context, ephemeral: bool = False) -> None:
-        if not (ctx.guild and isinstance(ctx.author, discord.Member) and ctx.author.voice and ctx.author.voice.channel):
-            await ctx.reply("You must be in a voice channel to use this command", ephemeral=True)
-            return
-        player = self.players.get(ctx.author.voice.channel.id)
+        player = self.players.get(voice_channel(ctx).id)
         if player is None or (not player.queue and not player.connection.is_playing()):
             await ctx.reply("Nothing is currently playing", ephemeral=True)
             return
@@ -162,17 +260,17 @@ class PolyPlayer(breadcord.module.ModuleCog):
                 inline=False,
             )
         if player.queue:
-            formated_values = [
-                f"{i}. [{video_info.data['title']}]({video_info.yt_url})\n"
-                for i, video_info in enumerate(player.queue, start=1)
-            ]
-            description = ""
-            while formated_values:
-                if len(description) + len(formated_values[0]) > 2000:
+            lines: list[str] = []
+            length = 0
+            for i, video_info in enumerate(player.queue, start=1):
+                line = f"{i}. [{video_info.data['title']}]({video_info.yt_url})\n"
+                if length + len(line) > 2000:
                     break
-                description += formated_values.pop(0)
-            if formated_values:
-                description += f"and {len(formated_values)} more..."
+                lines.append(line)
+                length += len(line)
+            description = "".join(lines)
+            if remaining := len(player.queue) - len(lines):
+                description += f"and {remaining} more..."
 
             embed.add_field(
                 name="Up next",
@@ -183,11 +281,10 @@ class PolyPlayer(breadcord.module.ModuleCog):
         await ctx.reply(embed=embed, ephemeral=ephemeral)
 
     @commands.hybrid_command()
+    @commands.guild_only()
+    @in_voice_channel()
     async def volume(self, ctx: commands.Context, volume_percentage: int | None = None) -> None:
-        if not (ctx.guild and isinstance(ctx.author, discord.Member) and ctx.author.voice and ctx.author.voice.channel):
-            await ctx.reply("You must be in a voice channel to use this command", ephemeral=True)
-            return
-        player = self.players.get(ctx.author.voice.channel.id)
+        player = self.players.get(voice_channel(ctx).id)
         if player is None:
             await ctx.reply("Nothing is currently playing", ephemeral=True)
             return
@@ -195,14 +292,16 @@ class PolyPlayer(breadcord.module.ModuleCog):
             await ctx.reply(f"Volume is currently at {player.volume * 100:.0f}%", ephemeral=True)
             return
         player.volume = max(0.5, min(2.0, volume_percentage / 100))
-        await ctx.reply(f"Volume set to {player.volume * 100:.0f}%")
+        if player.volume_adjustable:
+            await ctx.reply(f"Volume set to {player.volume * 100:.0f}%")
+        else:
+            await ctx.reply(f"Volume set to {player.volume * 100:.0f}%, starting from the next song")
 
     @commands.hybrid_command()
+    @commands.guild_only()
+    @in_voice_channel()
     async def pause(self, ctx: commands.Context) -> None:
-        if not (ctx.guild and isinstance(ctx.author, discord.Member) and ctx.author.voice and ctx.author.voice.channel):
-            await ctx.reply("You must be in a voice channel to use this command", ephemeral=True)
-            return
-        player = self.players.get(ctx.author.voice.channel.id)
+        player = self.players.get(voice_channel(ctx).id)
         if player is None:
             await ctx.reply("Nothing is currently playing")
             return
@@ -212,11 +311,10 @@ class PolyPlayer(breadcord.module.ModuleCog):
             player.connection.pause()
 
     @commands.hybrid_command()
+    @commands.guild_only()
+    @in_voice_channel()
     async def resume(self, ctx: commands.Context) -> None:
-        if not (ctx.guild and isinstance(ctx.author, discord.Member) and ctx.author.voice and ctx.author.voice.channel):
-            await ctx.reply("You must be in a voice channel to use this command", ephemeral=True)
-            return
-        player = self.players.get(ctx.author.voice.channel.id)
+        player = self.players.get(voice_channel(ctx).id)
         if player is None:
             await ctx.reply("Nothing is currently playing", ephemeral=True)
             return
@@ -226,11 +324,10 @@ class PolyPlayer(breadcord.module.ModuleCog):
             await ctx.reply("Not currently paused")
 
     @commands.hybrid_command()
+    @commands.guild_only()
+    @in_voice_channel()
     async def loop(self, ctx: commands.Context, value: bool | None = None) -> None:
-        if not (ctx.guild and isinstance(ctx.author, discord.Member) and ctx.author.voice and ctx.author.voice.channel):
-            await ctx.reply("You must be in a voice channel to use this command", ephemeral=True)
-            return
-        player = self.players.get(ctx.author.voice.channel.id)
+        player = self.players.get(voice_channel(ctx).id)
         if player is None:
             await ctx.reply("Nothing is currently playing", ephemeral=True)
             return
@@ -242,42 +339,57 @@ class PolyPlayer(breadcord.module.ModuleCog):
         await ctx.reply(f"Looping is now {'enabled' if player.loop else 'disabled'}")
 
     @commands.hybrid_command()
+    @commands.guild_only()
+    @in_voice_channel()
     async def skip(self, ctx: commands.Context, steps: int = 1) -> None:
-        if not (ctx.guild and isinstance(ctx.author, discord.Member) and ctx.author.voice and ctx.author.voice.channel):
-            await ctx.reply("You must be in a voice channel to use this command", ephemeral=True)
-            return
-        player = self.players.get(ctx.author.voice.channel.id)
+        player = self.players.get(voice_channel(ctx).id)
         if player is None:
             await ctx.reply("Nothing is currently playing", ephemeral=True)
             return
         if not player.queue:
             await ctx.reply("Nothing is currently playing", ephemeral=True)
             return
-        player.queue = player.queue[steps:]
+        skipped = [player.queue.popleft() for _ in range(min(steps, len(player.queue)))]
         if player.loop:
-            player.queue.extend(player.queue[:steps])
-        await ctx.reply(f"Skipped {steps} songs")
+            player.queue.extend(skipped)
+        await ctx.reply(f"Skipped {len(skipped)} songs")
 
 
 class Invidious(AIOLoadable):
-    def __init__(self, *, host_url: str | None = None) -> None:
+    HOST_CACHE_TTL = datetime.timedelta(hours=12)
+
+    def __init__(
+        self,
+        *,
+        session: aiohttp.ClientSession,
+        host_url: str | None = None,
+        host_cache_path: Path | None = None,
+    ) -> None:
         self.host_url: str | None = host_url.rstrip("/") if host_url else None
+        self.host_cache_path = host_cache_path
         self.logger = getLogger("poly_player.Invidious")
-        self.session: aiohttp.ClientSession = aiohttp.ClientSession()
+        self.session = session
+
+        self._video_cache: TTLCache[str, dict] = TTLCache(maxsize=512, ttl=600)
+        # Search rankings can change, so these shouldn't be kept around for as long
+        self._search_cache: TTLCache[str, list[dict]] = TTLCache(maxsize=256, ttl=60)
+        # The resolved googlevideo URLs expire, so only hold on to them briefly
+        self._audio_url_cache: TTLCache[tuple[str, int], URL] = TTLCache(maxsize=256, ttl=120)
 
     async def load(self) -> None:
         if not self.host_url:
-            self.host_url = await self.find_best_host()
+            self.host_url = self._load_cached_host() or await self.find_best_host()
         self.logger.debug(f"Using invidious instance: {self.host_url}")
 
     async def close(self) -> None:
-        await self.session.close()
+        # The session is owned by the cog
+        pass
 
     async def find_best_host(self) -> str:
         async with self.session.get("https://api.invidious.io/instances.json") as response:
             instances_list: list[dict] = [
                 instance
-                for _, instance in await response.json()
+                for _, instance in await response.json(loads=orjson.loads)
                 if all((
                     instance.get("stats") is not None,
                     instance.get("api"),
@@ -285,28 +397,66 @@ class Invidious(AIOLoadable):
                     instance.get("uri"),
                 ))
             ]
-        return max(
+        host_url = max(
             instances_list,
             key=lambda instance: instance["stats"]["usage"]["users"]["activeHalfyear"],
         )["uri"]
+        self._save_cached_host(host_url)
+        return host_url
+
+    def _load_cached_host(self) -> str | None:
+        if self.host_cache_path is None or not self.host_cache_path.is_file():
+            return None
+        try:
+            data = orjson.loads(self.host_cache_path.read_bytes())
+            chosen_at = datetime.datetime.fromisoformat(data["chosen_at"])
+            host_url = data["host_url"]
+        except OSError as error:
+            self.logger.warning(f"Could not read invidious host cache, ignoring it: {error}")
+            return None
+        except (ValueError, KeyError, TypeError):
+            self.logger.warning("Invalid invidious host cache, ignoring it")
+            return None
+        if datetime.datetime.now() - chosen_at > self.HOST_CACHE_TTL:
+            return None
+        return host_url
+
+    def _save_cached_host(self, host_url: str) -> None:
+        if self.host_cache_path is None:
+            return
+        try:
+            self.host_cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self.host_cache_path.write_bytes(
+                orjson.dumps({"host_url": host_url, "chosen_at": datetime.datetime.now().isoformat()}),
+            )
+        except OSError as error:
+            self.logger.warning(f"Could not write invidious host cache: {error}")
 
     async def get_video(self, video_id: str) -> dict:
+        if (cached := self._video_cache.get(video_id)) is not None:
+            return cached
+
         async def inner():
             self.logger.debug(f"Fetching video with ID: {video_id}")
             async with self.session.get(f"{self.host_url}/api/v1/videos/{video_id}") as response:
-                data = await response.json()
+                data = await response.json(loads=orjson.loads)
                 if error := data.get("error"):
                     raise BadResponseError(f"Error fetching video: {error}")
                 return data
         # The "The video returned by YouTube isn't the requested one" errors seems to be quite common
         # It seems like it can sometimes be fixed by just trying again?
         try:
-            return await inner()
+            data = await inner()
         except BadResponseError:
             self.logger.warning("Failed to fetch video, trying once more")
-            return await inner()
+            data = await inner()
+        self._video_cache[video_id] = data
+        return data
 
     async def search_for(self, query: str) -> list[dict]:
+        if (cached := self._search_cache.get(query)) is not None:
+            return cached
+
         self.logger.debug(f"Searching for: {query}")
         async with self.session.get(
             URL(f"{self.host_url}/api/v1/search") % {
@@ -315,70 +465,140 @@ class Invidious(AIOLoadable):
                 "type": "video",
             },
         ) as response:
-            return await response.json()
-
-    async def get_audio_url(self, video: dict) -> URL:
-        best = max(
+            if not response.ok:
+                raise BadResponseError(f"Error searching: {response.reason}")
+            results = await response.json(loads=orjson.loads)
+        if not isinstance(results, list):
+            error = results.get("error") if isinstance(results, dict) else None
+            raise BadResponseError(f"Error searching: {error or 'unexpected response'}")
+        self._search_cache[query] = results
+        return results
+
+    @staticmethod
+    def get_audio_format(video: dict) -> dict:
+        return max(
             (frmt for frmt in video["adaptiveFormats"] if frmt["type"].startswith("audio/")),
             key=lambda frmt: frmt["bitrate"],
         )
-        async with self.session.get(
-            URL(f"{self.host_url}/latest_version") % {
-                "id": video["videoId"],
-                "itag": best["itag"],
-                "local": "true",
-            },
-        ) as response:
-            if not response.ok:
-                raise BadResponseError(f"Error fetching audio: {response.reason}")
-            return response.url
+
+    async def get_audio_url(self, video: dict, audio_format: dict) -> URL:
+        cache_key = (video["videoId"], audio_format["itag"])
+        if (cached := self._audio_url_cache.get(cache_key)) is not None:
+            return cached
+
+        latest_version_url = URL(f"{self.host_url}/latest_version") % {
+            "id": video["videoId"],
+            "itag": audio_format["itag"],
+            "local": "true",
+        }
+        # We only care about where we get redirected to, so avoid having any audio sent our way
+        async with self.session.head(latest_version_url, allow_redirects=True) as response:
+            audio_url = response.url if response.ok else None
+        if audio_url is None:
+            # Not every instance accepts HEAD requests
+            async with self.session.get(latest_version_url, headers={"Range": "bytes=0-0"}) as response:
+                if not response.ok:
+                    raise BadResponseError(f"Error fetching audio: {response.reason}")
+                audio_url = response.url
+
+        self._audio_url_cache[cache_key] = audio_url
+        return audio_url
 
 
 class Translator(AIOLoadable):
-    def __init__(self, settings: breadcord.config.SettingsGroup, invidious: Invidious) -> None:
+    def __init__(
+        self,
+        *,
+        session: aiohttp.ClientSession,
+        settings: breadcord.config.SettingsGroup,
+        invidious: Invidious,
+    ) -> None:
+        self.session = session
         self.settings = settings
         self.invidious = invidious
-        self.session: aiohttp.ClientSession = aiohttp.ClientSession()
+        self.logger = getLogger("poly_player.Translator")
+        # Keeps us from hammering the invidious instance when resolving many tracks at once
+        self._search_semaphore = asyncio.Semaphore(8)
 
         self._spotify_token: str | None = None
         self._spotify_token_expires_at: datetime.datetime = datetime.datetime.min
 
     async def load(self) -> None:
-        pass
+        # Keep a token around at all times so that spotify links never have to wait for one
+        client_id = self.settings.spotify.client_id.value  # type: ignore[attr-defined]
+        client_secret = self.settings.spotify.client_secret.value  # type: ignore[attr-defined]
+        if client_id and client_secret:
+            self.refresh_spotify_token.start()
 
     async def close(self) -> None:
-        await self.session.close()
+        # The session is owned by the cog
+        self.refresh_spotify_token.cancel()
+
+    # Tokens last an hour. Transient network errors and 5xx responses are retried with backoff by the loop itself.
+    @tasks.loop(minutes=45)
+    async def refresh_spotify_token(self) -> None:
+        await self.update_spotify_token(force=True)
+
+    @refresh_spotify_token.error
+    async def on_refresh_spotify_token_error(self, error: BaseException) -> None:
+        self.logger.error("Stopped refreshing the spotify token", exc_info=error)
 
-    INVIDIOUS_ID_RE = re.compile(r".+watch\?v=(?P<id>[a-zA-Z0-9_-]+)$")
-    YOUTUBE_ID_RE = re.compile(
+    # A single pattern, so that a URL is only scanned once. The alternatives are tried in order.
+    MEDIA_ID_RE = re.compile(
         r"""
+        .+watch\?v=(?P<invidious_id>[a-zA-Z0-9_-]+)$
+        |
         https?://(?:
         (?:www\.)?youtube\.[a-z]+/watch(?:\?v=|/)
         |
         youtu\.be(?:/watch/*\?v=|/)
         )
-        (?P<id>[0-9a-zA-Z-_]+)
+        (?P<youtube_id>[0-9a-zA-Z-_]+)
         (?:$|&)
+        |
+        https?://open\.spotify\.com/track/(?P<spotify_id>\w+)
         """,
         flags=re.VERBOSE,
     )
-    SPOTIFY_ID_RE = re.compile(r"https?://open\.spotify\.com/track/(?P<id>\w+)")
 
     async def to_invidious_id(self, url: str) -> str | None:
-        if match := self.INVIDIOUS_ID_RE.match(url):
-            return match.group("id")
-        elif match := self.YOUTUBE_ID_RE.match(url):
-            return match.group("id")
-        elif match := self.SPOTIFY_ID_RE.match(url):
-            return await self.spotify_to_youtube_id(match.group("id"))
-        # TODO: Apple music
+        if not (match := self.MEDIA_ID_RE.match(url)):
+            # TODO: Apple music
+            return None
 
-        return None
+        if match.lastgroup == "spotify_id":
+            return await self.spotify_to_youtube_id(match.group("spotify_id"))
+        return match.group(match.lastgroup)  # type: ignore[arg-type]
+
+    SPOTIFY_TRACKS_PER_REQUEST = 50
 
     async def spotify_to_youtube_id(self, track_id: str) -> str:
-        await self.update_spotify_token()
+        return (await self.spotify_to_youtube_ids([track_id]))[0]
+
+    async def spotify_to_youtube_ids(self, track_ids: list[str]) -> list[str]:
+        tracks = await self.spotify_tracks_batch(track_ids)
+
+        async def search(track: dict) -> str:
+            query = track["name"] + " by " + " ".join(artist["name"] for artist in track["artists"])
+            async with self._search_semaphore:
+                results = await self.invidious.search_for(query)
+            return results[0]["videoId"]
+
+        return list(await asyncio.gather(*(search(track) for track in tracks)))
+
+    async def spotify_tracks_batch(self, track_ids: list[str]) -> list[dict]:
+        # Only happens if the background refresh hasn't managed to get a token
+        if not self._spotify_token_valid():
+            await self.update_spotify_token()
+        chunks = await asyncio.gather(*(
+            self._get_spotify_tracks(track_ids[i:i + self.SPOTIFY_TRACKS_PER_REQUEST])
+            for i in range(0, len(track_ids), self.SPOTIFY_TRACKS_PER_REQUEST)
+        ))
+        return [track for chunk in chunks for track in chunk]
+
+    async def _get_spotify_tracks(self, track_ids: list[str]) -> list[dict]:
         async with self.session.get(
-            f"https://api.spotify.com/v1/tracks/{track_id}",
+            URL("https://api.spotify.com/v1/tracks") % {"ids": ",".join(track_ids)},
             headers={"Authorization": f"Bearer {self._spotify_token}"},
         ) as response:
             if response.status == 401:
@@ -387,15 +607,19 @@ class Translator(AIOLoadable):
                 raise BadResponseError("Could not get track data")
             elif not response.ok:
                 raise BadResponseError(f"{response.status} Could not get track data: {response.reason}")
-            data = await response.json()
+            data = await response.json(loads=orjson.loads)
 
-        query = data["name"] + " by " + " ".join(artist["name"] for artist in data["artists"])
-        search = await self.invidious.search_for(query)
-        return search[0]["videoId"]
+        # Unknown IDs come back as null instead of failing the whole request
+        if any(track is None for track in data["tracks"]):
+            raise BadResponseError("Could not get track data")
+        return data["tracks"]
 
-    async def update_spotify_token(self) -> None:
+    def _spotify_token_valid(self) -> bool:
         # We add a minute so that we have a bit more breathing room
-        if self._spotify_token_expires_at > datetime.datetime.now() + datetime.timedelta(minutes=1):
+        return self._spotify_token_expires_at > datetime.datetime.now() + datetime.timedelta(minutes=1)
+
+    async def update_spotify_token(self, *, force: bool = False) -> None:
+        if not force and self._spotify_token_valid():
             return
         async with self.session.post(
             "https://accounts.spotify.com/api/token",
@@ -405,7 +629,9 @@ class Translator(AIOLoadable):
                 "client_secret": self.settings.spotify.client_secret.value,  # type: ignore[attr-defined]
             },
         ) as response:
-            data = await response.json()
+            if response.status >= 500:
+                response.raise_for_status()
+            data = await response.json(loads=orjson.loads)
             if data.get("error") == "invalid_client":
                 raise ValueError("Invalid spotify client id or secret")
             self._spotify_token = data["access_token"]